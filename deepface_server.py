@@ -1,24 +1,44 @@
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+import os
+
+# Worker / thread layout: WORKERS x INFERENCE_THREADS should roughly match physical cores.
+# Each worker's budget is split between executor threads and intra-op threads per call,
+# so EXECUTOR_THREADS x INTRA_OP_THREADS stays within INFERENCE_THREADS.
+# Thread env vars must be set before NumPy/OpenCV load their BLAS/OpenMP runtimes
+# and before TensorFlow is imported by DeepFace
+INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", "4"))
+WORKERS = int(os.environ.get("WORKERS", str(max(1, (os.cpu_count() or 1) // INFERENCE_THREADS))))
+EXECUTOR_THREADS = max(1, min(int(os.environ.get("EXECUTOR_THREADS", "2")), INFERENCE_THREADS))
+INTRA_OP_THREADS = max(1, INFERENCE_THREADS // EXECUTOR_THREADS)
+for thread_var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"):
+    os.environ.setdefault(thread_var, str(INTRA_OP_THREADS))
+os.environ.setdefault("TF_NUM_INTEROP_THREADS", "1")
+
 import numpy as np
 import cv2
-import requests
-from io import BytesIO
-from PIL import Image
+import httpx
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import LRUCache
 import tempfile
-import os
+import threading
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 import json
 from typing import Optional, List, Dict, Any
 import time
 
-
+cv2.setNumThreads(1)
 
 # DeepFace imports
 try:
     from deepface import DeepFace
-    from deepface.commons import functions
-    from deepface.modules import verification, detection, modeling
+    from deepface.modules import verification, detection, demography
+    from deepface.detectors import DetectorWrapper
     DEEPFACE_AVAILABLE = True
 except ImportError:
     print("DeepFace not installed. Installing...")
@@ -26,13 +46,36 @@ except ImportError:
     subprocess.run(["pip", "install", "deepface", "opencv-python", "pillow"])
     try:
         from deepface import DeepFace
-        from deepface.commons import functions
-        from deepface.modules import verification, detection, modeling
+        from deepface.modules import verification, detection, demography
+        from deepface.detectors import DetectorWrapper
         DEEPFACE_AVAILABLE = True
     except:
         DEEPFACE_AVAILABLE = False
         print("Failed to import DeepFace")
 
+if DEEPFACE_AVAILABLE:
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(INTRA_OP_THREADS)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except Exception as e:
+        print(f"Could not pin TensorFlow threads: {e}")
+
+# ONNX Runtime imports (optional, enables the shared RetinaFace detector)
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+    print("onnxruntime not installed. ONNX RetinaFace detector disabled")
+
+# OpenVINO imports (optional, compiles embedders for the batch path)
+try:
+    import openvino as ov
+    OPENVINO_AVAILABLE = True
+except ImportError:
+    OPENVINO_AVAILABLE = False
+
 app = FastAPI(
     title="DeepFace AI Server",
     description="Face recognition and analysis API using DeepFace",
@@ -53,6 +96,224 @@ AVAILABLE_MODELS = ["VGG-Face", "Facenet", "OpenFace", "DeepFace", "DeepID", "Ar
 AVAILABLE_DETECTORS = ["opencv", "ssd", "mtcnn", "dlib", "retinaface"]
 AVAILABLE_METRICS = ["cosine", "euclidean", "euclidean_l2"]
 
+# Shared RetinaFace-MobileNet-0.25 ONNX detector
+ONNX_DETECTOR = "retinaface_onnx"
+RETINAFACE_ONNX_PATH = os.environ.get(
+    "RETINAFACE_ONNX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "src", "models", "retinaface_mnet025.onnx")
+)
+RETINAFACE_MEAN = np.array([104, 117, 123], dtype=np.float32)
+RETINAFACE_MIN_SIZES = [[16, 32], [64, 128], [256, 512]]
+RETINAFACE_STEPS = [8, 16, 32]
+RETINAFACE_VARIANCE = [0.1, 0.2]
+RETINAFACE_CONFIDENCE = 0.8
+RETINAFACE_NMS_THRESHOLD = 0.4
+
+def create_retinaface_session():
+    """Create the process-wide ONNX Runtime session for RetinaFace"""
+    if not ONNXRUNTIME_AVAILABLE or not os.path.exists(RETINAFACE_ONNX_PATH):
+        return None
+    try:
+        so = ort.SessionOptions()
+        so.intra_op_num_threads = INTRA_OP_THREADS
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        return ort.InferenceSession(RETINAFACE_ONNX_PATH, sess_options=so, providers=['CPUExecutionProvider'])
+    except Exception as e:
+        print(f"Failed to load RetinaFace ONNX model: {e}")
+        return None
+
+RETINAFACE_SESSION = create_retinaface_session()
+if RETINAFACE_SESSION is not None:
+    AVAILABLE_DETECTORS.append(ONNX_DETECTOR)
+DEFAULT_DETECTOR = ONNX_DETECTOR if RETINAFACE_SESSION is not None else "opencv"
+
+# Batch download / verification concurrency
+DOWNLOAD_CONCURRENCY = 16
+DOWNLOAD_CONNECTION_LIMIT = 100
+DOWNLOAD_KEEPALIVE_LIMIT = 32
+DOWNLOAD_TIMEOUT = 10
+
+# Shared HTTP/2 client so image downloads reuse pooled keep-alive connections
+http_client = httpx.AsyncClient(
+    http2=True,
+    timeout=DOWNLOAD_TIMEOUT,
+    limits=httpx.Limits(
+        max_connections=DOWNLOAD_CONNECTION_LIMIT,
+        max_keepalive_connections=DOWNLOAD_KEEPALIVE_LIMIT
+    )
+)
+verify_executor = ThreadPoolExecutor(max_workers=EXECUTOR_THREADS)
+
+# Batched embedding for batch-verify
+EMBEDDING_BATCH_SIZE = 32
+EMBEDDING_CACHE_SIZE = 2000
+# (url, model, detector) -> (F, D) embeddings of every face in that image
+embedding_cache = LRUCache(maxsize=EMBEDDING_CACHE_SIZE)
+
+# Long edge cap applied to every decoded image before detection
+MAX_IMAGE_SIZE = 1280
+
+# Per-thread scratch buffer uploads are read into (matches the 10MB upload limit)
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+scratch = threading.local()
+
+# Models preloaded at startup (comma separated env overrides, default: the endpoint defaults).
+# Anything else is built on first use
+DEFAULT_MODEL = "VGG-Face"
+PRELOAD_MODELS = [m for m in os.environ.get("PRELOAD_MODELS", DEFAULT_MODEL).split(",") if m]
+PRELOAD_DETECTORS = [d for d in os.environ.get("PRELOAD_DETECTORS", DEFAULT_DETECTOR).split(",") if d]
+PRELOAD_LOCK_PATH = os.path.join(os.environ.get("DEEPFACE_HOME", os.path.expanduser("~")), ".deepface", "preload.lock")
+ANALYSIS_ACTIONS = ['emotion', 'age', 'gender', 'race']
+# Analysis models are loaded lazily on first /api/analyze unless listed here (e.g. "emotion,age")
+PRELOAD_ANALYSIS = [a for a in os.environ.get("PRELOAD_ANALYSIS", "").split(",") if a in ANALYSIS_ACTIONS]
+USE_OPENVINO = OPENVINO_AVAILABLE and os.environ.get("USE_OPENVINO", "1") != "0"
+
+# Exported ONNX embedders ({model}.fp16.onnx) run on CUDA when a GPU is available
+EMBEDDER_ONNX_DIR = os.environ.get(
+    "EMBEDDER_ONNX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "src", "models")
+)
+CUDA_AVAILABLE = ONNXRUNTIME_AVAILABLE and "CUDAExecutionProvider" in ort.get_available_providers()
+
+class CompiledEmbedder:
+    """OpenVINO-compiled embedder exposing a Keras-style predict"""
+    
+    def __init__(self, keras_model):
+        self.compiled = ov.compile_model(
+            ov.convert_model(keras_model),
+            "CPU",
+            {"PERFORMANCE_HINT": "THROUGHPUT", "INFERENCE_NUM_THREADS": INTRA_OP_THREADS}
+        )
+    
+    def predict(self, x: np.ndarray, batch_size: int = 32, verbose: int = 0) -> np.ndarray:
+        chunks = [x[start:start + batch_size] for start in range(0, len(x), batch_size)]
+        outputs = [None] * len(chunks)
+        
+        def collect(request, index):
+            outputs[index] = request.get_output_tensor(0).data.copy()
+        
+        # Keep several inference requests in flight across CPU streams
+        queue = ov.AsyncInferQueue(self.compiled)
+        queue.set_callback(collect)
+        for index, chunk in enumerate(chunks):
+            queue.start_async({0: np.ascontiguousarray(chunk, dtype=np.float32)}, index)
+        queue.wait_all()
+        
+        return np.concatenate(outputs)
+
+class OnnxEmbedder:
+    """ONNX Runtime embedder (FP16 on CUDA, CPU fallback) exposing a Keras-style predict"""
+    
+    def __init__(self, onnx_path: str):
+        so = ort.SessionOptions()
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        so.intra_op_num_threads = INTRA_OP_THREADS
+        providers = [
+            ('CUDAExecutionProvider', {'device_id': 0, 'cudnn_conv_algo_search': 'EXHAUSTIVE'}),
+            'CPUExecutionProvider'
+        ]
+        self.session = ort.InferenceSession(onnx_path, sess_options=so, providers=providers)
+        
+        # ORT silently falls back to CPU when the CUDA libraries fail to load
+        if self.session.get_providers()[0] != 'CUDAExecutionProvider':
+            raise RuntimeError("CUDAExecutionProvider failed to initialize")
+        
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_dtype = np.float16 if model_input.type == "tensor(float16)" else np.float32
+        # Keras exports are NHWC; channel-first graphs need a transpose
+        self.channels_first = len(model_input.shape) == 4 and model_input.shape[1] == 3
+    
+    def predict(self, x: np.ndarray, batch_size: int = 32, verbose: int = 0) -> np.ndarray:
+        outputs = []
+        for start in range(0, len(x), batch_size):
+            chunk = x[start:start + batch_size]
+            if self.channels_first:
+                chunk = chunk.transpose(0, 3, 1, 2)
+            chunk = np.ascontiguousarray(chunk, dtype=self.input_dtype)
+            outputs.append(self.session.run(None, {self.input_name: chunk})[0])
+        return np.concatenate(outputs).astype(np.float32)
+
+def find_embedder_onnx(model_name: str) -> Optional[str]:
+    """Path of an exported ONNX embedder for a model, preferring FP16 weights"""
+    for suffix in (".fp16.onnx", ".onnx"):
+        path = os.path.join(EMBEDDER_ONNX_DIR, f"{model_name}{suffix}")
+        if os.path.exists(path):
+            return path
+    return None
+
+# Module-level model caches, populated once at startup
+MODELS: Dict[str, Any] = {}
+COMPILED_MODELS: Dict[str, Any] = {}
+DETECTORS: Dict[str, Any] = {}
+ANALYSIS_MODELS: Dict[str, Any] = {}
+
+@app.on_event("startup")
+async def preload_models():
+    """Build recognition, detector and analysis models once per process"""
+    if not DEEPFACE_AVAILABLE:
+        return
+    
+    # Serialize preloading across workers so only the first one downloads missing weights
+    os.makedirs(os.path.dirname(PRELOAD_LOCK_PATH), exist_ok=True)
+    with open(PRELOAD_LOCK_PATH, "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            build_preloaded_models()
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    print(f"Preloaded models: {list(MODELS)}")
+    print(f"Preloaded detectors: {list(DETECTORS)}")
+
+def build_preloaded_models():
+    """Build every model listed for preloading into the module-level caches"""
+    for name in PRELOAD_MODELS:
+        try:
+            MODELS[name] = DeepFace.build_model(name)
+        except Exception as e:
+            print(f"Failed to preload model {name}: {e}")
+    
+    if CUDA_AVAILABLE:
+        for name in MODELS:
+            onnx_path = find_embedder_onnx(name)
+            if onnx_path is None:
+                continue
+            try:
+                COMPILED_MODELS[name] = OnnxEmbedder(onnx_path)
+            except Exception as e:
+                print(f"Failed to load CUDA embedder {name}: {e}")
+    
+    if USE_OPENVINO:
+        for name, facial_model in MODELS.items():
+            if name in COMPILED_MODELS:
+                continue
+            try:
+                COMPILED_MODELS[name] = CompiledEmbedder(facial_model.model)
+            except Exception as e:
+                print(f"Failed to compile model {name} with OpenVINO: {e}")
+    
+    for name in PRELOAD_DETECTORS:
+        if name == ONNX_DETECTOR:
+            continue
+        try:
+            DETECTORS[name] = DetectorWrapper.build_model(name)
+        except Exception as e:
+            print(f"Failed to preload detector {name}: {e}")
+    
+    for action in PRELOAD_ANALYSIS:
+        try:
+            ANALYSIS_MODELS[action] = DeepFace.build_model(action.capitalize())
+        except Exception as e:
+            print(f"Failed to preload analysis model {action}: {e}")
+
+@app.on_event("shutdown")
+async def close_http_client():
+    """Close pooled download connections"""
+    await http_client.aclose()
+
 @app.get("/")
 async def root():
     return {
@@ -75,6 +336,10 @@ async def health_check():
         "models": AVAILABLE_MODELS if DEEPFACE_AVAILABLE else [],
         "detectors": AVAILABLE_DETECTORS if DEEPFACE_AVAILABLE else [],
         "metrics": AVAILABLE_METRICS if DEEPFACE_AVAILABLE else [],
+        "loaded_models": list(MODELS),
+        "loaded_detectors": list(DETECTORS),
+        "compiled_models": list(COMPILED_MODELS),
+        "cuda_available": CUDA_AVAILABLE,
         "timestamp": time.time()
     }
     return status
@@ -84,7 +349,7 @@ async def get_models():
     return {
         "success": True,
         "models": AVAILABLE_MODELS,
-        "default": "VGG-Face"
+        "default": DEFAULT_MODEL
     }
 
 @app.get("/api/detectors")
@@ -92,64 +357,274 @@ async def get_detectors():
     return {
         "success": True,
         "detectors": AVAILABLE_DETECTORS,
-        "default": "opencv",
+        "default": DEFAULT_DETECTOR,
         "recommendations": {
+            ONNX_DETECTOR: "Fast and accurate, shared ONNX Runtime session",
             "opencv": "Fastest, good for real-time",
             "mtcnn": "More accurate, slower",
             "retinaface": "Most accurate, slowest"
         }
     }
 
-def load_image_from_url(url: str):
+def limit_image_size(img_array: np.ndarray):
+    """
+    Downscale so the long edge is at most MAX_IMAGE_SIZE before detection.
+    Returns the image and the factor mapping its pixels back to the original
+    """
+    h, w = img_array.shape[:2]
+    long_edge = max(h, w)
+    if long_edge <= MAX_IMAGE_SIZE:
+        return img_array, 1.0
+    
+    ratio = MAX_IMAGE_SIZE / long_edge
+    new_w, new_h = int(w * ratio), int(h * ratio)
+    resized = cv2.resize(img_array, (new_w, new_h), interpolation=cv2.INTER_AREA)
+    return resized, w / new_w
+
+def scale_region(region: Dict[str, Any], scale: float) -> Dict[str, Any]:
+    """Map a face region from the downscaled image back to original image pixels"""
+    if not region or scale == 1.0:
+        return region
+    
+    mapped = dict(region)
+    for key in ("x", "y", "w", "h"):
+        if mapped.get(key) is not None:
+            mapped[key] = int(round(mapped[key] * scale))
+    for key in ("left_eye", "right_eye"):
+        if mapped.get(key) is not None:
+            mapped[key] = tuple(int(round(v * scale)) for v in mapped[key])
+    return mapped
+
+def decode_image_bytes(contents):
+    """Decode raw image bytes into a BGR numpy array and its downscale factor"""
+    # OpenCV decodes straight to BGR, no PIL round trip or channel swap needed
+    img_array = cv2.imdecode(np.frombuffer(contents, dtype=np.uint8), cv2.IMREAD_COLOR)
+    
+    if img_array is None:
+        raise HTTPException(status_code=400, detail="Unsupported or corrupt image data")
+    
+    return limit_image_size(img_array)
+
+async def load_image_from_url(url: str):
     """Load image from URL"""
     try:
-        response = requests.get(url, timeout=10)
+        response = await http_client.get(url)
         response.raise_for_status()
-        image = Image.open(BytesIO(response.content))
-        
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Convert to numpy array
-        img_array = np.array(image)
-        
-        # Convert BGR to RGB if needed
-        if len(img_array.shape) == 3 and img_array.shape[2] == 3:
-            img_array = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-        
-        return img_array
+        return decode_image_bytes(response.content)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to load image from URL: {str(e)}")
 
+def get_scratch_buffer() -> np.ndarray:
+    """Return this thread's reusable upload buffer, allocating it once"""
+    if not hasattr(scratch, "buffer"):
+        scratch.buffer = np.empty(MAX_UPLOAD_BYTES, dtype=np.uint8)
+    return scratch.buffer
+
 def load_image_from_file(file: UploadFile):
     """Load image from uploaded file"""
     try:
-        contents = file.file.read()
-        image = Image.open(BytesIO(contents))
-        
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+        buffer = get_scratch_buffer()
+        file.file.seek(0)
         
-        # Convert to numpy array
-        img_array = np.array(image)
+        # Read straight into the reused buffer instead of a fresh bytes object
+        if hasattr(file.file, "readinto"):
+            contents = buffer[:file.file.readinto(memoryview(buffer))]
+        else:
+            # No readinto: decode the bytes we were handed rather than copying them again
+            contents = file.file.read(MAX_UPLOAD_BYTES)
         
-        # Convert BGR to RGB if needed
-        if len(img_array.shape) == 3 and img_array.shape[2] == 3:
-            img_array = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+        if len(contents) == MAX_UPLOAD_BYTES and file.file.read(1):
+            raise HTTPException(status_code=413, detail="Image exceeds the 10MB upload limit")
         
-        return img_array
+        return decode_image_bytes(contents)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to load image: {str(e)}")
     finally:
         file.file.seek(0)
 
+async def fetch(semaphore: asyncio.Semaphore, url: str):
+    """Download and decode an image from URL over the shared client"""
+    async with semaphore:
+        response = await http_client.get(url)
+        response.raise_for_status()
+    img_array, _ = decode_image_bytes(response.content)
+    return img_array
+
+async def fetch_all(urls: List[str]) -> List[Any]:
+    """Download all URLs concurrently; failed downloads are returned as exceptions"""
+    semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+    return await asyncio.gather(
+        *[fetch(semaphore, url) for url in urls],
+        return_exceptions=True
+    )
+
+def retinaface_priors(height: int, width: int) -> np.ndarray:
+    """Anchor boxes (cx, cy, w, h) normalized to the input size"""
+    priors = []
+    for step, min_sizes in zip(RETINAFACE_STEPS, RETINAFACE_MIN_SIZES):
+        rows, cols = int(np.ceil(height / step)), int(np.ceil(width / step))
+        ys, xs = np.meshgrid(np.arange(rows), np.arange(cols), indexing='ij')
+        cx = (xs.ravel() + 0.5) * step / width
+        cy = (ys.ravel() + 0.5) * step / height
+        
+        # Anchors are ordered per cell, then per min size
+        level = np.empty((cx.size, len(min_sizes), 4), dtype=np.float32)
+        for k, min_size in enumerate(min_sizes):
+            level[:, k, 0] = cx
+            level[:, k, 1] = cy
+            level[:, k, 2] = min_size / width
+            level[:, k, 3] = min_size / height
+        priors.append(level.reshape(-1, 4))
+    return np.concatenate(priors, axis=0).astype(np.float32)
+
+def detect(img_array: np.ndarray) -> List[Dict[str, Any]]:
+    """Detect faces with the shared RetinaFace session, returning DeepFace-style regions"""
+    if RETINAFACE_SESSION is None:
+        raise ValueError(f"{ONNX_DETECTOR} detector is not loaded")
+    
+    height, width = img_array.shape[:2]
+    blob = (img_array.astype(np.float32) - RETINAFACE_MEAN).transpose(2, 0, 1)[None]
+    input_name = RETINAFACE_SESSION.get_inputs()[0].name
+    loc, conf, _ = RETINAFACE_SESSION.run(None, {input_name: blob})
+    
+    priors = retinaface_priors(height, width)
+    loc, scores = loc[0], conf[0][:, 1]
+    keep = scores > RETINAFACE_CONFIDENCE
+    loc, scores, priors = loc[keep], scores[keep], priors[keep]
+    
+    # Decode offsets against anchors into pixel-space (x, y, w, h)
+    centers = priors[:, :2] + loc[:, :2] * RETINAFACE_VARIANCE[0] * priors[:, 2:]
+    sizes = priors[:, 2:] * np.exp(loc[:, 2:] * RETINAFACE_VARIANCE[1])
+    boxes = np.hstack([centers - sizes / 2, sizes]) * np.array([width, height, width, height])
+    
+    indices = cv2.dnn.NMSBoxes(boxes.tolist(), scores.tolist(), RETINAFACE_CONFIDENCE, RETINAFACE_NMS_THRESHOLD)
+    
+    regions = []
+    for i in np.array(indices).flatten():
+        x, y, w, h = (int(v) for v in boxes[i])
+        # Clip to the image, shrinking the box by whatever falls outside the left/top edge
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, width), min(y + h, height)
+        x, y, w, h = x0, y0, x1 - x0, y1 - y0
+        if w <= 0 or h <= 0:
+            continue
+        regions.append({
+            "x": x,
+            "y": y,
+            "w": w,
+            "h": h,
+            "confidence": float(scores[i])
+        })
+    return regions
+
+def crop_faces(img_array: np.ndarray) -> List[Dict[str, Any]]:
+    """Crop every face found by the ONNX detector"""
+    faces = []
+    for region in detect(img_array):
+        x, y, w, h = region["x"], region["y"], region["w"], region["h"]
+        faces.append({"face": img_array[y:y + h, x:x + w], "region": region})
+    return faces
+
+def resolve_detector_input(img_array: np.ndarray, detector: str, enforce_detection: bool = True):
+    """
+    Route ONNX detection ahead of DeepFace.
+    Returns the image to hand to DeepFace, the detector_backend to use and,
+    for ONNX crops, the face region in the full image (None otherwise)
+    """
+    if detector != ONNX_DETECTOR:
+        return img_array, detector, None
+    
+    faces = crop_faces(img_array)
+    if not faces:
+        if not enforce_detection:
+            return img_array, "skip", None
+        raise ValueError("Face could not be detected")
+    
+    largest = max(faces, key=lambda f: f["region"]["w"] * f["region"]["h"])
+    return largest["face"], "skip", largest["region"]
+
+def get_model(model_name: str):
+    """Return the cached recognition model, building it on first use"""
+    if model_name not in MODELS:
+        MODELS[model_name] = DeepFace.build_model(model_name)
+    return MODELS[model_name]
+
+def preprocess_faces(img_array: np.ndarray, regions: List[Dict[str, Any]], input_shape) -> np.ndarray:
+    """
+    Crop, letterbox-resize and normalize faces in one pass.
+    Writes a float32 (N, H, W, 3) batch ready for the embedder, matching DeepFace's preprocessing
+    """
+    # Model input_shape is (width, height)
+    target_w, target_h = input_shape
+    staging = np.zeros((len(regions), target_h, target_w, 3), dtype=np.uint8)
+    
+    for i, region in enumerate(regions):
+        x, y, w, h = region["x"], region["y"], region["w"], region["h"]
+        crop = img_array[y:y + h, x:x + w]
+        
+        # Resize straight into the padded slot of the staging batch
+        factor = min(target_h / h, target_w / w)
+        new_w, new_h = max(1, int(w * factor)), max(1, int(h * factor))
+        top, left = (target_h - new_h) // 2, (target_w - new_w) // 2
+        cv2.resize(crop, (new_w, new_h), dst=staging[i, top:top + new_h, left:left + new_w], interpolation=cv2.INTER_AREA)
+    
+    return np.multiply(staging, np.float32(1 / 255), dtype=np.float32)
+
+def extract_face_batch(img_array: np.ndarray, model_name: str, detector: str) -> np.ndarray:
+    """Detected, aligned and resized faces of an image as an (F, H, W, 3) batch"""
+    target_size = get_model(model_name).input_shape
+    
+    if detector == ONNX_DETECTOR:
+        # Fused path: ONNX boxes go straight to the embedder input buffer
+        regions = detect(img_array)
+        if not regions:
+            height, width = img_array.shape[:2]
+            regions = [{"x": 0, "y": 0, "w": width, "h": height}]
+        return preprocess_faces(img_array, regions, target_size)
+    
+    # input_shape is (width, height); extract_faces takes it swapped, as deepface's represent does
+    face_objs = detection.extract_faces(
+        img_path=img_array,
+        target_size=(target_size[1], target_size[0]),
+        detector_backend=detector,
+        enforce_detection=False,
+        align=True
+    )
+    faces = [face_obj["face"] for face_obj in face_objs]
+    return np.concatenate([face.reshape((-1,) + face.shape[-3:]) for face in faces])
+
+def embed_faces(faces: np.ndarray, model_name: str) -> np.ndarray:
+    """Embed a batch of faces in a single forward pass"""
+    embedder = COMPILED_MODELS.get(model_name) or get_model(model_name).model
+    embeddings = embedder.predict(faces, batch_size=EMBEDDING_BATCH_SIZE, verbose=0)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    
+    # DeepFace l2 normalizes VGG-Face embeddings
+    if model_name == "VGG-Face":
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    
+    return embeddings
+
+def embedding_distances(a: np.ndarray, b: np.ndarray, metric: str) -> np.ndarray:
+    """Pairwise (len(a), len(b)) distances between two embedding matrices"""
+    if metric == "cosine":
+        norms = np.linalg.norm(a, axis=1)[:, None] * np.linalg.norm(b, axis=1)[None, :]
+        return 1 - (a @ b.T) / norms
+    
+    if metric == "euclidean_l2":
+        a = a / np.linalg.norm(a, axis=1, keepdims=True)
+        b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    
+    squared = (a * a).sum(axis=1)[:, None] + (b * b).sum(axis=1)[None, :] - 2 * (a @ b.T)
+    return np.sqrt(np.maximum(squared, 0))
+
 @app.post("/api/analyze")
 async def analyze_faces(
     image: Optional[UploadFile] = File(None),
     image_url: Optional[str] = Form(None),
-    detector: str = Form("opencv"),
+    detector: str = Form(DEFAULT_DETECTOR),
     enforce_detection: bool = Form(True)
 ):
     """
@@ -165,20 +640,43 @@ async def analyze_faces(
     try:
         # Load image from either file or URL
         if image:
-            img_array = load_image_from_file(image)
+            img_array, scale = load_image_from_file(image)
         elif image_url:
-            img_array = load_image_from_url(image_url)
+            img_array, scale = await load_image_from_url(image_url)
         else:
             raise HTTPException(status_code=400, detail="Either image file or image_url must be provided")
         
         # Perform face analysis
-        analysis = DeepFace.analyze(
-            img_path=img_array,
-            actions=['emotion', 'age', 'gender', 'race'],
-            detector_backend=detector,
-            enforce_detection=enforce_detection,
-            silent=True
-        )
+        if detector == ONNX_DETECTOR:
+            # Analyze pre-cropped faces, bypassing DeepFace's detector
+            faces_found = crop_faces(img_array)
+            if not faces_found and enforce_detection:
+                raise ValueError("Face could not be detected")
+            
+            analysis = []
+            for face in faces_found:
+                face_analysis = demography.analyze(
+                    img_path=face["face"],
+                    actions=ANALYSIS_ACTIONS,
+                    detector_backend="skip",
+                    enforce_detection=False,
+                    silent=True
+                )[0]
+                face_analysis["region"] = face["region"]
+                face_analysis["confidence"] = face["region"]["confidence"]
+                analysis.append(face_analysis)
+        else:
+            analysis = demography.analyze(
+                img_path=img_array,
+                actions=ANALYSIS_ACTIONS,
+                detector_backend=detector,
+                enforce_detection=enforce_detection,
+                silent=True
+            )
+        
+        # Map regions back to the uploaded image's coordinates
+        for face in (analysis if isinstance(analysis, list) else [analysis]):
+            face["region"] = scale_region(face.get("region", {}), scale)
         
         # Convert analysis to serializable format
         faces = []
@@ -226,6 +724,8 @@ async def analyze_faces(
             "analysis_time": time.time()
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = str(e)
         # Check if it's a "face not detected" error
@@ -246,8 +746,8 @@ async def verify_faces(
     img2: Optional[UploadFile] = File(None),
     img1_url: Optional[str] = Form(None),
     img2_url: Optional[str] = Form(None),
-    model: str = Form("VGG-Face"),
-    detector: str = Form("opencv"),
+    model: str = Form(DEFAULT_MODEL),
+    detector: str = Form(DEFAULT_DETECTOR),
     metrics: str = Form("cosine"),
     enforce_detection: bool = Form(False)
 ):
@@ -270,28 +770,31 @@ async def verify_faces(
     try:
         # Load first image
         if img1:
-            img1_array = load_image_from_file(img1)
+            img1_array, img1_scale = load_image_from_file(img1)
         elif img1_url:
-            img1_array = load_image_from_url(img1_url)
+            img1_array, img1_scale = await load_image_from_url(img1_url)
         else:
             raise HTTPException(status_code=400, detail="First image must be provided")
         
         # Load second image
         if img2:
-            img2_array = load_image_from_file(img2)
+            img2_array, img2_scale = load_image_from_file(img2)
         elif img2_url:
-            img2_array = load_image_from_url(img2_url)
+            img2_array, img2_scale = await load_image_from_url(img2_url)
         else:
             raise HTTPException(status_code=400, detail="Second image must be provided")
         
         # Perform face verification
         start_time = time.time()
         
-        result = DeepFace.verify(
-            img1_path=img1_array,
-            img2_path=img2_array,
+        img1_input, backend, img1_region = resolve_detector_input(img1_array, detector, enforce_detection)
+        img2_input, _, img2_region = resolve_detector_input(img2_array, detector, enforce_detection)
+        
+        result = verification.verify(
+            img1_path=img1_input,
+            img2_path=img2_input,
             model_name=model,
-            detector_backend=detector,
+            detector_backend=backend,
             distance_metric=metrics,
             enforce_detection=enforce_detection,
             silent=True
@@ -299,6 +802,12 @@ async def verify_faces(
         
         processing_time = time.time() - start_time
         
+        # ONNX crops are verified with detector_backend="skip", so deepface reports the
+        # whole crop at 0,0; use the detected region in the full image instead
+        facial_areas = result.get("facial_areas", {})
+        img1_face = img1_region if img1_region is not None else facial_areas.get("img1", {})
+        img2_face = img2_region if img2_region is not None else facial_areas.get("img2", {})
+        
         # Convert result to serializable format
         response = {
             "success": True,
@@ -311,13 +820,15 @@ async def verify_faces(
             "metrics": metrics,
             "processing_time": processing_time,
             "analysis": {
-                "img1_face": result.get("facial_areas", {}).get("img1", {}),
-                "img2_face": result.get("facial_areas", {}).get("img2", {})
+                "img1_face": scale_region(img1_face, img1_scale),
+                "img2_face": scale_region(img2_face, img2_scale)
             }
         }
         
         return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = str(e)
         # Check if it's a "face not detected" error
@@ -338,8 +849,8 @@ async def verify_faces(
 async def batch_verify(
     target_image: UploadFile = File(...),
     image_urls: str = Form(...),
-    model: str = Form("VGG-Face"),
-    detector: str = Form("opencv"),
+    model: str = Form(DEFAULT_MODEL),
+    detector: str = Form(DEFAULT_DETECTOR),
     metrics: str = Form("cosine"),
     threshold: float = Form(0.4)
 ):
@@ -349,54 +860,99 @@ async def batch_verify(
     if not DEEPFACE_AVAILABLE:
         raise HTTPException(status_code=503, detail="DeepFace not available")
     
+    if model not in AVAILABLE_MODELS:
+        raise HTTPException(status_code=400, detail=f"Invalid model. Available: {AVAILABLE_MODELS}")
+    
+    if detector not in AVAILABLE_DETECTORS:
+        raise HTTPException(status_code=400, detail=f"Invalid detector. Available: {AVAILABLE_DETECTORS}")
+    
+    if metrics not in AVAILABLE_METRICS:
+        raise HTTPException(status_code=400, detail=f"Invalid metric. Available: {AVAILABLE_METRICS}")
+    
     try:
         # Load target image
-        target_array = load_image_from_file(target_image)
+        target_array, _ = load_image_from_file(target_image)
         
         # Parse image URLs
         urls = json.loads(image_urls)
         if not isinstance(urls, list):
             raise HTTPException(status_code=400, detail="image_urls must be a JSON array")
         
-        results = []
         start_time = time.time()
         
-        for i, url in enumerate(urls):
+        loop = asyncio.get_running_loop()
+        model_threshold = verification.find_threshold(model, metrics)
+        
+        # Embed the target faces
+        target_faces = await loop.run_in_executor(verify_executor, extract_face_batch, target_array, model, detector)
+        target_embeddings = await loop.run_in_executor(verify_executor, embed_faces, target_faces, model)
+        
+        # Snapshot cache hits now so this request's own inserts can't evict them
+        image_embeddings = {}
+        uncached_urls = []
+        for url in dict.fromkeys(urls):
+            cached = embedding_cache.get((url, model, detector))
+            if cached is not None:
+                image_embeddings[url] = cached
+            else:
+                uncached_urls.append(url)
+        
+        # Download only images whose embeddings are not cached yet
+        compare_arrays = await fetch_all(uncached_urls)
+        
+        errors = {}
+        
+        async def extract_url(url, compare_array):
             try:
-                # Load comparison image
-                compare_array = load_image_from_url(url)
-                
-                # Verify faces
-                result = DeepFace.verify(
-                    img1_path=target_array,
-                    img2_path=compare_array,
-                    model_name=model,
-                    detector_backend=detector,
-                    distance_metric=metrics,
-                    enforce_detection=False,
-                    silent=True
-                )
-                
-                similarity = 1 - result.get("distance", 1.0)
-                verified = similarity > threshold
-                
-                results.append({
-                    "url": url,
-                    "verified": bool(verified),
-                    "distance": float(result.get("distance", 1.0)),
-                    "similarity": float(similarity),
-                    "match": bool(result.get("verified", False))
-                })
-                
+                if isinstance(compare_array, Exception):
+                    raise compare_array
+                return await loop.run_in_executor(verify_executor, extract_face_batch, compare_array, model, detector)
             except Exception as e:
+                errors[url] = str(e)
+                return None
+        
+        # Detect faces concurrently, then embed them all in one batched call
+        compare_faces = await asyncio.gather(
+            *[extract_url(url, compare_array) for url, compare_array in zip(uncached_urls, compare_arrays)]
+        )
+        extracted = [(url, faces) for url, faces in zip(uncached_urls, compare_faces) if faces is not None]
+        
+        if extracted:
+            all_faces = np.concatenate([faces for _, faces in extracted])
+            all_embeddings = await loop.run_in_executor(verify_executor, embed_faces, all_faces, model)
+            
+            offset = 0
+            for url, faces in extracted:
+                image_embeddings[url] = all_embeddings[offset:offset + len(faces)]
+                embedding_cache[(url, model, detector)] = image_embeddings[url]
+                offset += len(faces)
+        
+        results = []
+        for url in urls:
+            embeddings = image_embeddings.get(url)
+            
+            if embeddings is None:
                 results.append({
                     "url": url,
                     "verified": False,
                     "distance": 1.0,
                     "similarity": 0.0,
                     "match": False,
-                    "error": str(e)
+                    "error": errors.get(url, "Failed to embed image")
                 })
+                continue
+            
+            # Closest pair of faces between target and comparison image
+            distance = float(embedding_distances(target_embeddings, embeddings, metrics).min())
+            similarity = 1 - distance
+            
+            results.append({
+                "url": url,
+                "verified": bool(similarity > threshold),
+                "distance": distance,
+                "similarity": float(similarity),
+                "match": bool(distance <= model_threshold)
+            })
         
         processing_time = time.time() - start_time
         
@@ -419,6 +975,8 @@ async def batch_verify(
             "threshold": threshold
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Batch verification failed: {str(e)}")
 
@@ -426,7 +984,7 @@ async def batch_verify(
 async def detect_faces(
     image: Optional[UploadFile] = File(None),
     image_url: Optional[str] = Form(None),
-    detector: str = Form("opencv")
+    detector: str = Form(DEFAULT_DETECTOR)
 ):
     """
     Detect faces in an image (faster than full analysis)
@@ -437,13 +995,25 @@ async def detect_faces(
     try:
         # Load image
         if image:
-            img_array = load_image_from_file(image)
+            img_array, scale = load_image_from_file(image)
         elif image_url:
-            img_array = load_image_from_url(image_url)
+            img_array, scale = await load_image_from_url(image_url)
         else:
             raise HTTPException(status_code=400, detail="Either image file or image_url must be provided")
         
         # Detect faces only
+        if detector == ONNX_DETECTOR:
+            face_regions = [
+                {"width": region["w"], "height": region["h"]}
+                for region in (scale_region(r, scale) for r in detect(img_array))
+            ]
+            return {
+                "success": True,
+                "faces": face_regions,
+                "face_count": len(face_regions),
+                "detector": detector
+            }
+        
         faces = detection.extract_faces(
             img_path=img_array,
             detector_backend=detector,
@@ -478,6 +1048,8 @@ async def detect_faces(
             "detector": detector
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = str(e)
         if "Face could not be detected" in error_msg:
@@ -510,13 +1082,16 @@ if __name__ == "__main__":
     print(f"Available models: {AVAILABLE_MODELS}")
     print(f"Available detectors: {AVAILABLE_DETECTORS}")
     print(f"Available metrics: {AVAILABLE_METRICS}")
+    print(f"Workers: {WORKERS} x {EXECUTOR_THREADS} executor threads x {INTRA_OP_THREADS} intra-op threads")
     print("=" * 50)
     print("Server starting on http://localhost:8000")
     print("=" * 50)
     
     uvicorn.run(
-        app,
+        "deepface_server:app",
         host="0.0.0.0",
         port=8000,
-        reload=True
+        workers=WORKERS,
+        loop="uvloop",
+        http="httptools"
     )
\ No newline at end of file
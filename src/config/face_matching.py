@@ -3,13 +3,27 @@ import numpy as np
 import face_recognition
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Optional
+from typing import BinaryIO, List, Optional, Union
 import aiofiles
+import aiohttp
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import LRUCache
 import os
+import json
+import tempfile
+import threading
 from PIL import Image
 import io
 import base64
 
+# Numba JIT for the distance kernel (falls back to NumPy when unavailable)
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
 app = FastAPI(title="Face Matching API")
 
 # CORS middleware
@@ -23,47 +37,263 @@ app.add_middleware(
 
 # Configuration
 FACE_MATCH_THRESHOLD = 0.6
+DOWNLOAD_CONCURRENCY = 16
+ENCODING_CACHE_SIZE = 2000
+encode_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
 KNOWN_FACES_DIR = "known_faces"
+ENCODINGS_FILE = "encodings.npy"
+NAMES_FILE = "names.json"
+ENCODING_SIZE = 128
+# Long edge cap applied to every decoded image before detection
+MAX_IMAGE_SIZE = 1280
+# HOG detection without upsampling; each upsample doubles detection work
+FACE_DETECTION_MODEL = "hog"
+FACE_DETECTION_UPSAMPLE = int(os.environ.get("FACE_DETECTION_UPSAMPLE", "0"))
+FACE_ENCODING_JITTERS = 1
+# Cheap Haar cascade prefilter run before HOG detection and encoding
+HAAR_PREFILTER = os.environ.get("HAAR_PREFILTER", "1") != "0"
+HAAR_USE_LOCATIONS = os.environ.get("HAAR_USE_LOCATIONS", "0") != "0"
+HAAR_SCALE_FACTOR = 1.3
+HAAR_MIN_NEIGHBORS = 5
+HAAR_MIN_SIZE = (40, 40)
+# Encodings are stored in half precision and compared in single precision
+ENCODING_STORAGE_DTYPE = np.float16
+ENCODING_COMPUTE_DTYPE = np.float32
 
 # Create directories if they don't exist
 os.makedirs(KNOWN_FACES_DIR, exist_ok=True)
 
+HAAR_CASCADE_PATH = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+# CascadeClassifier is not thread-safe, so each encode thread gets its own
+haar_local = threading.local()
+
+def get_haar_cascade() -> cv2.CascadeClassifier:
+    """Return this thread's Haar cascade, building it on first use"""
+    if not hasattr(haar_local, "cascade"):
+        haar_local.cascade = cv2.CascadeClassifier(HAAR_CASCADE_PATH)
+    return haar_local.cascade
+
+if NUMBA_AVAILABLE:
+    @numba.njit(cache=True, fastmath=True, parallel=True)
+    def pairwise_l2(matrix, probe):
+        """L2 distance from probe to every row of matrix"""
+        n, k = matrix.shape
+        out = np.empty(n, np.float32)
+        for i in numba.prange(n):
+            s = np.float32(0.0)
+            for j in range(k):
+                d = matrix[i, j] - probe[j]
+                s += d * d
+            out[i] = np.sqrt(s)
+        return out
+    
+    @numba.njit(cache=True, fastmath=True, parallel=True)
+    def bulk_l2(a, b):
+        """L2 distance between every row of a and every row of b"""
+        m, k = a.shape
+        n = b.shape[0]
+        out = np.empty((m, n), np.float32)
+        # Rows of a are spread across threads
+        for i in numba.prange(m):
+            for j in range(n):
+                s = np.float32(0.0)
+                for c in range(k):
+                    d = a[i, c] - b[j, c]
+                    s += d * d
+                out[i, j] = np.sqrt(s)
+        return out
+else:
+    def pairwise_l2(matrix, probe):
+        """L2 distance from probe to every row of matrix"""
+        return np.linalg.norm(matrix - probe, axis=1)
+    
+    def bulk_l2(a, b):
+        """L2 distance between every row of a and every row of b"""
+        squared = (a * a).sum(axis=1)[:, None] + (b * b).sum(axis=1)[None, :] - 2 * (a @ b.T)
+        return np.sqrt(np.maximum(squared, 0))
+
+def compute_face_distances(matrix: np.ndarray, probe: np.ndarray) -> np.ndarray:
+    """Distances between a probe encoding and an (N, 128) encoding matrix"""
+    # The JIT kernel does no bounds checking, so mismatched sizes must be rejected here
+    if matrix.ndim != 2 or probe.ndim != 1 or matrix.shape[1] != probe.shape[0]:
+        raise ValueError(f"Encoding shape mismatch: {matrix.shape} vs {probe.shape}")
+    
+    return pairwise_l2(
+        np.ascontiguousarray(matrix, dtype=ENCODING_COMPUTE_DTYPE),
+        np.ascontiguousarray(probe, dtype=ENCODING_COMPUTE_DTYPE)
+    )
+
+def compute_bulk_face_distances(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """(M, N) distances between two encoding matrices"""
+    if a.ndim != 2 or b.ndim != 2 or a.shape[1] != b.shape[1]:
+        raise ValueError(f"Encoding shape mismatch: {a.shape} vs {b.shape}")
+    
+    return bulk_l2(
+        np.ascontiguousarray(a, dtype=ENCODING_COMPUTE_DTYPE),
+        np.ascontiguousarray(b, dtype=ENCODING_COMPUTE_DTYPE)
+    )
+
+def limit_image_size(image: np.ndarray) -> np.ndarray:
+    """Downscale so the long edge is at most MAX_IMAGE_SIZE before detection"""
+    h, w = image.shape[:2]
+    long_edge = max(h, w)
+    if long_edge <= MAX_IMAGE_SIZE:
+        return image
+    
+    ratio = MAX_IMAGE_SIZE / long_edge
+    return cv2.resize(image, (int(w * ratio), int(h * ratio)), interpolation=cv2.INTER_AREA)
+
+@app.on_event("startup")
+async def warm_distance_kernel():
+    """Trigger JIT compilation before the first request"""
+    compute_face_distances(
+        np.zeros((1, ENCODING_SIZE), dtype=ENCODING_COMPUTE_DTYPE),
+        np.zeros(ENCODING_SIZE, dtype=ENCODING_COMPUTE_DTYPE)
+    )
+    compute_bulk_face_distances(
+        np.zeros((1, ENCODING_SIZE), dtype=ENCODING_COMPUTE_DTYPE),
+        np.zeros((1, ENCODING_SIZE), dtype=ENCODING_COMPUTE_DTYPE)
+    )
+
 class FaceMatchingService:
     def __init__(self):
-        self.known_face_encodings = []
-        self.known_face_names = []
+        # SoA layout: one contiguous (N, 128) matrix plus a parallel names list
+        self.enc_matrix = np.empty((0, ENCODING_SIZE), dtype=ENCODING_COMPUTE_DTYPE)
+        self.names = []
+        # URL -> (N, 128) encodings of every face in that image
+        self.encoding_cache = LRUCache(maxsize=ENCODING_CACHE_SIZE)
+        # URL -> future for encodings currently being fetched
+        self.pending_encodings = {}
+    
+    def load_known_faces(self, event_id: str) -> np.ndarray:
+        """Load known faces for a specific event as a memory-mapped (N, 128) matrix"""
+        event_dir = os.path.join(KNOWN_FACES_DIR, event_id)
+        encodings_path = os.path.join(event_dir, ENCODINGS_FILE)
+        if not os.path.exists(encodings_path):
+            return self.load_legacy_faces(event_dir)
+        
+        return np.load(encodings_path, mmap_mode='r')
+    
+    def legacy_face_files(self, event_dir: str) -> List[str]:
+        """Per-face .npy files from the old one-file-per-encoding layout"""
+        if not os.path.isdir(event_dir):
+            return []
+        return sorted(
+            filename for filename in os.listdir(event_dir)
+            if filename.endswith(".npy") and filename != ENCODINGS_FILE
+        )
     
-    def load_known_faces(self, event_id: str):
-        """Load known faces for a specific event"""
+    def load_legacy_faces(self, event_dir: str) -> np.ndarray:
+        """Stack legacy per-face encodings; they are migrated on the next add_known_face"""
+        filenames = self.legacy_face_files(event_dir)
+        if not filenames:
+            return np.empty((0, ENCODING_SIZE), dtype=ENCODING_STORAGE_DTYPE)
+        
+        encodings = [np.load(os.path.join(event_dir, filename)).reshape(ENCODING_SIZE) for filename in filenames]
+        return np.stack(encodings).astype(ENCODING_STORAGE_DTYPE)
+    
+    def load_known_face_names(self, event_id: str) -> List[str]:
+        """Load the names matching each row of the event's encodings matrix"""
         event_dir = os.path.join(KNOWN_FACES_DIR, event_id)
-        if not os.path.exists(event_dir):
+        names_path = os.path.join(event_dir, NAMES_FILE)
+        if not os.path.exists(names_path):
+            if os.path.exists(os.path.join(event_dir, ENCODINGS_FILE)):
+                return []
+            # Legacy layout: the file name is the only label a face had
+            return [os.path.splitext(filename)[0] for filename in self.legacy_face_files(event_dir)]
+        
+        with open(names_path) as f:
+            return json.load(f)
+    
+    def add_known_face(self, event_id: str, name: str, encoding: np.ndarray):
+        """Append a face encoding to the event's encodings matrix"""
+        event_dir = os.path.join(KNOWN_FACES_DIR, event_id)
+        os.makedirs(event_dir, exist_ok=True)
+        
+        # Copy out of the memory map before the file is replaced
+        existing = np.array(self.load_known_faces(event_id))
+        names = self.load_known_face_names(event_id)
+        
+        encodings = np.vstack([existing, encoding[None, :]]).astype(ENCODING_STORAGE_DTYPE)
+        names.append(name)
+        
+        # Write to temp files and swap them in, so readers holding the old mmap never see a truncated file
+        self.replace_file(os.path.join(event_dir, ENCODINGS_FILE), lambda f: np.save(f, encodings))
+        self.replace_file(os.path.join(event_dir, NAMES_FILE), lambda f: f.write(json.dumps(names).encode()))
+    
+    def replace_file(self, path: str, write):
+        """Atomically replace path with content produced by write(file)"""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+    
+    def load_event_faces(self, event_id: str):
+        """Load an event's known faces into the in-memory encodings matrix"""
+        self.enc_matrix = np.ascontiguousarray(self.load_known_faces(event_id), dtype=ENCODING_COMPUTE_DTYPE)
+        self.names = self.load_known_face_names(event_id)
+    
+    def add_face(self, name: str, encoding: np.ndarray):
+        """Append a face to the in-memory encodings matrix"""
+        self.enc_matrix = np.vstack([self.enc_matrix, encoding[None, :].astype(ENCODING_COMPUTE_DTYPE)])
+        self.names.append(name)
+    
+    def match_face(self, encoding: np.ndarray) -> List[dict]:
+        """Compare an encoding against every face in the in-memory encodings matrix"""
+        if len(self.enc_matrix) == 0:
             return []
         
-        face_encodings = []
-        for filename in os.listdir(event_dir):
-            if filename.endswith(".npy"):
-                encoding = np.load(os.path.join(event_dir, filename))
-                face_encodings.append(encoding)
+        return self.rank_matches(compute_face_distances(self.enc_matrix, encoding), self.names)
+    
+    def match_known_faces(self, event_id: str, encoding: np.ndarray) -> List[dict]:
+        """Compare an encoding against every known face of an event"""
+        known_encodings = self.load_known_faces(event_id)
+        if len(known_encodings) == 0:
+            return []
+        
+        names = self.load_known_face_names(event_id)
+        return self.rank_matches(compute_face_distances(known_encodings, encoding), names)
+    
+    def rank_matches(self, face_distances: np.ndarray, names: List[str]) -> List[dict]:
+        """Matches under the threshold, best first"""
+        matches = []
+        for index in np.flatnonzero(face_distances <= 1 - FACE_MATCH_THRESHOLD):
+            matches.append({
+                'name': names[index] if index < len(names) else None,
+                'similarity': float(1 - face_distances[index]),
+                'face_distance': float(face_distances[index])
+            })
         
-        return face_encodings
+        matches.sort(key=lambda x: x['similarity'], reverse=True)
+        return matches
     
-    async def extract_face_encoding(self, image_bytes: bytes) -> Optional[np.ndarray]:
-        """Extract face encoding from image bytes"""
+    async def extract_face_encoding(self, image_source: Union[bytes, BinaryIO]) -> Optional[np.ndarray]:
+        """Extract face encoding from image bytes or an open image file"""
         try:
-            # Load image
-            image = face_recognition.load_image_file(io.BytesIO(image_bytes))
+            # Load image, decoding uploads straight from their spooled file
+            if isinstance(image_source, bytes):
+                image_source = io.BytesIO(image_source)
+            image = limit_image_size(face_recognition.load_image_file(image_source))
             
             # Find face locations
-            face_locations = face_recognition.face_locations(image)
+            face_locations = face_recognition.face_locations(
+                image, number_of_times_to_upsample=FACE_DETECTION_UPSAMPLE, model=FACE_DETECTION_MODEL
+            )
             
             if len(face_locations) == 0:
                 return None
             
             # Get face encodings
-            face_encodings = face_recognition.face_encodings(image, face_locations)
+            face_encodings = face_recognition.face_encodings(
+                image, face_locations, num_jitters=FACE_ENCODING_JITTERS
+            )
             
             if len(face_encodings) > 0:
-                return face_encodings[0]
+                return face_encodings[0].astype(ENCODING_COMPUTE_DTYPE)
             
             return None
             
@@ -71,53 +301,57 @@ class FaceMatchingService:
             print(f"Error extracting face encoding: {e}")
             return None
     
-    async def find_matching_faces(self, selfie_bytes: bytes, event_images: List[dict]) -> List[dict]:
+    async def find_matching_faces(self, selfie: Union[bytes, BinaryIO], event_images: List[dict]) -> List[dict]:
         """Find matching faces between selfie and event images"""
         try:
             # Extract selfie face encoding
-            selfie_encoding = await self.extract_face_encoding(selfie_bytes)
+            selfie_encoding = await self.extract_face_encoding(selfie)
             
             if selfie_encoding is None:
                 return []
             
+            # Collect every face encoding from every event image into one matrix
+            all_encodings = []
+            face_owners = []
+            
+            event_encodings = await self.get_event_encodings(
+                [event_image['url'] for event_image in event_images]
+            )
+            
+            for image_index, encodings in enumerate(event_encodings):
+                if encodings is not None and len(encodings) > 0:
+                    all_encodings.append(encodings)
+                    face_owners.extend([image_index] * len(encodings))
+            
+            if not all_encodings:
+                return []
+            
+            # Compare selfie against all event faces in a single vectorized pass
+            encoding_matrix = np.vstack(all_encodings)
+            face_distances = compute_face_distances(encoding_matrix, selfie_encoding)
+            
+            # Keep the closest face per event image
+            best_distances = np.full(len(event_images), np.inf)
+            np.minimum.at(best_distances, np.array(face_owners), face_distances)
+            
+            # Convert distance to similarity (1 - distance)
+            match_mask = best_distances <= 1 - FACE_MATCH_THRESHOLD
+            
             matching_images = []
             
-            for event_image in event_images:
-                try:
-                    # Download or get event image
-                    event_image_bytes = await self.download_image(event_image['url'])
-                    
-                    if event_image_bytes:
-                        # Extract face encodings from event image
-                        event_face_encodings = face_recognition.face_encodings(
-                            face_recognition.load_image_file(io.BytesIO(event_image_bytes)),
-                            face_recognition.face_locations(
-                                face_recognition.load_image_file(io.BytesIO(event_image_bytes))
-                            )
-                        )
-                        
-                        # Compare with selfie
-                        for event_encoding in event_face_encodings:
-                            # Calculate face distance
-                            face_distance = face_recognition.face_distance([selfie_encoding], event_encoding)[0]
-                            
-                            # Convert distance to similarity (1 - distance)
-                            similarity = 1 - face_distance
-                            
-                            if similarity >= FACE_MATCH_THRESHOLD:
-                                matching_images.append({
-                                    'file_id': event_image['_id'],
-                                    'file_url': event_image['url'],
-                                    'file_name': event_image['originalName'],
-                                    'similarity': float(similarity),
-                                    'confidence': float(similarity * 100),
-                                    'face_distance': float(face_distance)
-                                })
-                                break
-                                
-                except Exception as e:
-                    print(f"Error processing event image: {e}")
-                    continue
+            for image_index in np.flatnonzero(match_mask):
+                event_image = event_images[image_index]
+                face_distance = best_distances[image_index]
+                similarity = 1 - face_distance
+                
+                matching_images.append({
+                    'file_id': event_image['_id'],
+                    'file_url': event_image['url'],
+                    'file_name': event_image['originalName'],
+                    'similarity': float(similarity),
+                    'confidence': float(similarity * 100),
+                    'face_distance': float(face_distance)
+                })
             
             # Sort by similarity (descending)
             matching_images.sort(key=lambda x: x['similarity'], reverse=True)
@@ -128,18 +362,104 @@ class FaceMatchingService:
             print(f"Error in find_matching_faces: {e}")
             return []
     
-    async def download_image(self, url: str) -> Optional[bytes]:
+    def encode_image(self, image_bytes: bytes) -> np.ndarray:
+        """Encode every face in an image as an (N, 128) matrix"""
+        # Decode once, detect once, encode from the cached image
+        image = limit_image_size(face_recognition.load_image_file(io.BytesIO(image_bytes)))
+        
+        face_locations = None
+        if HAAR_PREFILTER:
+            # Skip the expensive detector and embedder on images with no face candidate
+            gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+            candidates = get_haar_cascade().detectMultiScale(
+                gray, HAAR_SCALE_FACTOR, HAAR_MIN_NEIGHBORS, minSize=HAAR_MIN_SIZE
+            )
+            if len(candidates) == 0:
+                return np.empty((0, ENCODING_SIZE), dtype=ENCODING_COMPUTE_DTYPE)
+            if HAAR_USE_LOCATIONS:
+                # Reuse the cascade boxes as (top, right, bottom, left) and skip HOG
+                face_locations = [(int(y), int(x + w), int(y + h), int(x)) for x, y, w, h in candidates]
+        
+        if face_locations is None:
+            face_locations = face_recognition.face_locations(
+                image, number_of_times_to_upsample=FACE_DETECTION_UPSAMPLE, model=FACE_DETECTION_MODEL
+            )
+        face_encodings = face_recognition.face_encodings(
+            image, face_locations, num_jitters=FACE_ENCODING_JITTERS
+        )
+        
+        if len(face_encodings) == 0:
+            return np.empty((0, ENCODING_SIZE), dtype=ENCODING_COMPUTE_DTYPE)
+        return np.stack(face_encodings).astype(ENCODING_COMPUTE_DTYPE)
+    
+    async def get_event_encodings(self, urls: List[str]) -> List[Optional[np.ndarray]]:
+        """Encodings per URL, served from the LRU cache where possible"""
+        loop = asyncio.get_running_loop()
+        # URL -> encodings resolved for this call, snapshotted so later evictions can't drop them
+        resolved = {}
+        waiting = {}
+        owned = {}
+        
+        for url in urls:
+            if url in resolved or url in waiting or url in owned:
+                continue
+            cached = self.encoding_cache.get(url)
+            if cached is not None:
+                resolved[url] = cached
+            elif url in self.pending_encodings:
+                # Another request is already fetching this URL
+                waiting[url] = self.pending_encodings[url]
+            else:
+                owned[url] = self.pending_encodings[url] = loop.create_future()
+        
+        async def encode_url(url: str, image_bytes: Optional[bytes]):
+            encodings = None
+            try:
+                if image_bytes:
+                    # HOG detection and encoding are CPU bound, keep them off the event loop
+                    encodings = await loop.run_in_executor(encode_executor, self.encode_image, image_bytes)
+                    self.encoding_cache[url] = encodings
+            except Exception as e:
+                print(f"Error processing event image: {e}")
+            resolved[url] = encodings
+            owned[url].set_result(encodings)
+        
+        try:
+            # Download all uncached event images concurrently before encoding
+            downloads = await self.download_images(list(owned))
+            await asyncio.gather(*[encode_url(url, image_bytes) for url, image_bytes in zip(owned, downloads)])
+        finally:
+            for url, future in owned.items():
+                if not future.done():
+                    future.set_result(None)
+                self.pending_encodings.pop(url, None)
+        
+        for url, future in waiting.items():
+            resolved[url] = await future
+        
+        return [resolved.get(url) for url in urls]
+    
+    async def download_image(self, session: aiohttp.ClientSession, url: str) -> Optional[bytes]:
         """Download image from URL"""
         try:
-            import aiohttp
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        return await response.read()
-                    return None
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return await response.read()
+                return None
         except Exception as e:
             print(f"Error downloading image: {e}")
             return None
+    
+    async def download_images(self, urls: List[str]) -> List[Optional[bytes]]:
+        """Download images concurrently over a shared session"""
+        semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+        
+        async def fetch(session: aiohttp.ClientSession, url: str) -> Optional[bytes]:
+            async with semaphore:
+                return await self.download_image(session, url)
+        
+        async with aiohttp.ClientSession() as session:
+            return await asyncio.gather(*[fetch(session, url) for url in urls])
 
 # Initialize service
 face_service = FaceMatchingService()
@@ -152,14 +472,14 @@ async def process_selfie(
 ):
     """Process selfie and find matching faces in event"""
     try:
-        # Read selfie
-        selfie_bytes = await selfie.read()
+        # Decode the selfie from the upload's spooled file without copying it into bytes
+        await selfie.seek(0)
         
         # TODO: Load event images from database
         event_images = []  # This should come from your database
         
         # Find matching faces
-        matches = await face_service.find_matching_faces(selfie_bytes, event_images)
+        matches = await face_service.find_matching_faces(selfie.file, event_images)
         
         return {
             "success": True,
@@ -175,8 +495,8 @@ async def process_selfie(
 async def extract_face_encoding(image: UploadFile = File(...)):
     """Extract face encoding from image"""
     try:
-        image_bytes = await image.read()
-        encoding = await face_service.extract_face_encoding(image_bytes)
+        await image.seek(0)
+        encoding = await face_service.extract_face_encoding(image.file)
         
         if encoding is None:
             raise HTTPException(status_code=400, detail="No face detected in image")
@@ -205,7 +525,7 @@ async def compare_faces(
         enc2 = np.array(encoding2)
         
         # Calculate face distance
-        distance = face_recognition.face_distance([enc1], enc2)[0]
+        distance = compute_face_distances(enc1[None, :], enc2)[0]
         similarity = 1 - distance
         
         return {
@@ -218,6 +538,43 @@ async def compare_faces(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/face-match/compare-bulk")
+async def compare_faces_bulk(
+    encodings1: List[List[float]],
+    encodings2: List[List[float]]
+):
+    """Compare every encoding in one list against every encoding in another"""
+    try:
+        if not encodings1 or not encodings2:
+            # Nothing to compare; keep the (M, N) shape of the result lists
+            distances = np.empty((len(encodings1), len(encodings2)), dtype=ENCODING_COMPUTE_DTYPE)
+        else:
+            # Convert lists to (M, 128) and (N, 128) matrices; malformed input fails the shape check
+            enc1 = np.array(encodings1, dtype=ENCODING_COMPUTE_DTYPE)
+            enc2 = np.array(encodings2, dtype=ENCODING_COMPUTE_DTYPE)
+            
+            # Calculate all pairwise face distances
+            distances = compute_bulk_face_distances(enc1, enc2)
+        similarities = 1 - distances
+        
+        matches = [
+            {"index1": int(i), "index2": int(j), "similarity": float(similarities[i, j])}
+            for i, j in zip(*np.nonzero(similarities >= FACE_MATCH_THRESHOLD))
+        ]
+        
+        return {
+            "success": True,
+            "distances": distances.tolist(),
+            "similarities": similarities.tolist(),
+            "matches": matches,
+            "total_matches": len(matches)
+        }
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/face-match/health")
 async def health_check():
     """Health check endpoint"""
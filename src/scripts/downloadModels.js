@@ -49,6 +49,18 @@ const models = [
   }
 ];
 
+// RetinaFace-MobileNet-0.25 ONNX detector used by deepface_server.py (retinaface_onnx).
+// There is no official ONNX release, so point RETINAFACE_ONNX_URL at a hosted export,
+// or produce one locally with src/scripts/export_retinaface_onnx.py
+const retinafaceOnnx = {
+  name: 'retinaface_mnet025.onnx',
+  url: process.env.RETINAFACE_ONNX_URL
+};
+
+if (retinafaceOnnx.url) {
+  models.push(retinafaceOnnx);
+}
+
 async function downloadModel(model) {
   console.log(`Downloading ${model.name}...`);
   
@@ -86,6 +98,11 @@ async function downloadAllModels() {
     }
   }
   
+  if (!retinafaceOnnx.url && !fs.existsSync(path.join(modelsDir, retinafaceOnnx.name))) {
+    console.log(`\nℹ️  ${retinafaceOnnx.name} not downloaded: set RETINAFACE_ONNX_URL or run`);
+    console.log('   python src/scripts/export_retinaface_onnx.py --repo <Pytorch_Retinaface checkout>');
+  }
+  
   console.log('\n✅ All models downloaded successfully!');
   console.log(`Models saved to: ${modelsDir}`);
 }
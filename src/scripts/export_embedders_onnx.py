@@ -0,0 +1,47 @@
+"""
+Export DeepFace recognition models to ONNX (FP32 and FP16) for the deepface server's CUDA embedder.
+
+    pip install tf2onnx onnx onnxconverter-common
+    python src/scripts/export_embedders_onnx.py VGG-Face Facenet
+
+Writes <model>.onnx and <model>.fp16.onnx into src/models (or EMBEDDER_ONNX_DIR), which is where
+deepface_server.find_embedder_onnx looks for them at startup.
+"""
+import argparse
+import os
+
+import onnx
+import tf2onnx
+from deepface import DeepFace
+from onnxconverter_common import float16
+
+DEFAULT_OUTPUT_DIR = os.environ.get(
+    "EMBEDDER_ONNX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "models")
+)
+
+def export_model(model_name: str, output_dir: str):
+    """Convert a DeepFace model's Keras graph to ONNX, then cast a copy to FP16"""
+    keras_model = DeepFace.build_model(model_name).model
+    
+    fp32_path = os.path.join(output_dir, f"{model_name}.onnx")
+    tf2onnx.convert.from_keras(keras_model, opset=13, output_path=fp32_path)
+    print(f"Saved {fp32_path}")
+    
+    fp16_model = float16.convert_float_to_float16(onnx.load(fp32_path))
+    fp16_path = os.path.join(output_dir, f"{model_name}.fp16.onnx")
+    onnx.save(fp16_model, fp16_path)
+    print(f"Saved {fp16_path}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Export DeepFace embedders to ONNX")
+    parser.add_argument("models", nargs="+", help="DeepFace model names, e.g. VGG-Face Facenet ArcFace")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR)
+    args = parser.parse_args()
+    
+    os.makedirs(args.output_dir, exist_ok=True)
+    for model_name in args.models:
+        export_model(model_name, args.output_dir)
+
+if __name__ == "__main__":
+    main()
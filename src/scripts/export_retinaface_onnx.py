@@ -0,0 +1,62 @@
+"""
+Export RetinaFace-MobileNet-0.25 to ONNX for the deepface server's retinaface_onnx detector.
+
+Uses the reference implementation and weights from https://github.com/biubug6/Pytorch_Retinaface:
+    git clone https://github.com/biubug6/Pytorch_Retinaface
+    # download mobilenet0.25_Final.pth from that repo's README into Pytorch_Retinaface/weights
+    python src/scripts/export_retinaface_onnx.py --repo Pytorch_Retinaface
+
+The exported graph takes a BGR, mean-subtracted (104, 117, 123) NCHW float32 image of any size
+and returns (loc, conf, landms), which is what deepface_server.detect decodes.
+"""
+import argparse
+import os
+import sys
+
+import torch
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "models")
+
+def load_weights(model, weights_path):
+    """Load a checkpoint, stripping the DataParallel 'module.' prefix if present"""
+    state_dict = torch.load(weights_path, map_location="cpu")
+    state_dict = {k[len("module."):] if k.startswith("module.") else k: v for k, v in state_dict.items()}
+    model.load_state_dict(state_dict)
+    return model
+
+def main():
+    parser = argparse.ArgumentParser(description="Export RetinaFace-MobileNet-0.25 to ONNX")
+    parser.add_argument("--repo", required=True, help="Path to a Pytorch_Retinaface checkout")
+    parser.add_argument("--weights", help="mobilenet0.25_Final.pth (default: <repo>/weights/mobilenet0.25_Final.pth)")
+    parser.add_argument("--output", default=os.path.join(MODELS_DIR, "retinaface_mnet025.onnx"))
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(args.repo))
+    from data import cfg_mnet
+    from models.retinaface import RetinaFace
+
+    weights = args.weights or os.path.join(args.repo, "weights", "mobilenet0.25_Final.pth")
+
+    # phase='test' applies softmax to the class scores inside the graph
+    cfg = dict(cfg_mnet, pretrain=False)
+    model = load_weights(RetinaFace(cfg=cfg, phase="test"), weights).eval()
+
+    dummy = torch.randn(1, 3, 640, 640)
+    torch.onnx.export(
+        model,
+        dummy,
+        args.output,
+        input_names=["input"],
+        output_names=["loc", "conf", "landms"],
+        dynamic_axes={
+            "input": {2: "height", 3: "width"},
+            "loc": {1: "priors"},
+            "conf": {1: "priors"},
+            "landms": {1: "priors"}
+        },
+        opset_version=11
+    )
+    print(f"Saved {args.output}")
+
+if __name__ == "__main__":
+    main()